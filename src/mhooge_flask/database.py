@@ -1,614 +1,794 @@
-from enum import Enum
-from abc import abstractmethod
-import importlib
-import os
-import pkgutil
-import re
-import sqlite3
-from shutil import copyfile
-from sqlite3 import ProgrammingError, OperationalError, DatabaseError, Connection, Cursor
-from subprocess import Popen
-from threading import get_ident
-from time import time
-from typing import Dict, List, Tuple
-
-from marshmallow.fields import Enum as MarshEnum
-from marshmallow_sqlalchemy import SQLAlchemyAutoSchema, SQLAlchemySchema
-from marshmallow_sqlalchemy.fields import Related, RelatedList
-from sqlalchemy import Integer, create_engine, String, ForeignKey, delete, event, select, text
-from sqlalchemy.orm import Session, Mapped, sessionmaker, DeclarativeBase, mapped_column, Mapper, RelationshipDirection, InstrumentedAttribute
-from sqlalchemy.sql.schema import CallableColumnDefault
-from sqlalchemy.exc import OperationalError as SQLAOperationError
-from pydantic import create_model, Field, BaseModel
-from loguru import logger
-
-class DBException(OperationalError, ProgrammingError):
-    def __init__(self, *args):
-        super().__init__(args)
-
-class Query:
-    def __init__(self, query: str, *params, format_func = None, default = None, context = None):
-        collected_params = []
-        for param in params:
-            if type(param) in (list, tuple):
-                collected_params.append(tuple(param))
-            else:
-                collected_params.append(param)
-
-        execute_many = collected_params != [] and all(isinstance(param, tuple) for param in collected_params)
-
-        if not execute_many:
-            collected_params = tuple(collected_params)
-
-        self.params = collected_params
-        self.query = query
-        self.execute_many = execute_many
-        self.format_func = format_func
-        self.default = default
-        self.context = context
-
-    def __str__(self):
-        query = self.query
-        for param in self.params:
-            query = query.replace("?", str(param), 1)
-
-        return query
-
-    def __call__(self, commit: bool = True, raw: bool = False):
-        with self.context as context:
-            conn: Connection = context.connection
-            try:
-                if self.execute_many:
-                    cursor = conn.cursor().executemany(self.query, self.params)
-                else:
-                    cursor = conn.cursor().execute(self.query, self.params)
-
-                if commit:
-                    conn.commit()
-
-                if raw or self.format_func is None:
-                    return cursor
-
-                if callable(self.format_func):
-                    return self.format_func(cursor)
-
-                if self.format_func == "all":
-                    return cursor.fetchall() or ([] if self.default is None else self.default)
-
-                if self.format_func == "one":
-                    return cursor.fetchone() or self.default
-
-                if self.format_func == "unpack_all":
-                    return [x[0] for x in cursor] or ([] if self.default is None else self.default)
-
-                if self.format_func == "unpack_one":
-                    val = cursor.fetchone()
-                    return self.default if val is None else val[0]
-
-                raise ValueError("Formatting function for query is invalid.", self.format_func)
-
-            except (OperationalError, ProgrammingError, DatabaseError) as exc:
-                raise DBException(exc.args)
-
-class RelatedExtra(Related):
-    def _serialize(self, value, attr, obj):
-        if value is None:
-            return None
-
-        ret = {prop.key: getattr(value, prop.key, None) for prop in self.related_keys}
-        ret.update(value.extra_fields)
-        ret.update(value.dump())
-        return ret if len(ret) > 1 else next(iter(ret.values()))
-
-def _fix_type(data):
-    if isinstance(data, dict):
-        return {key: _fix_type(data[key]) for key in data}
-    if isinstance(data, list):
-        return [_fix_type(entry) for entry in data]
-
-    if isinstance(data, Enum):
-        return data.value
-
-    return data
-
-class Base(DeclarativeBase):
-    __marsh__ = SQLAlchemySchema
-    __pydantic__ = BaseModel
-    __validate_fields__ = {}
-    __serialize_relationships__ = []
-
-    @property
-    def extra_fields(self):
-        return {}
-
-    def dump(self, many: bool | None = None, included_relations: List[InstrumentedAttribute] | None = None, **key_mapping):
-        marsh = self.__marsh__()
-
-        if included_relations is not None:
-            fields_to_include = set()
-            for relationship in included_relations:
-                field = relationship.key
-
-                if field not in marsh.declared_fields:
-                    continue
-
-                if isinstance(marsh.declared_fields[field], (Related, RelatedList)):
-                    fields_to_include.add(field)
-
-            marsh.dump_fields = {
-                field: marsh.declared_fields[field]
-                for field in marsh.declared_fields
-                if not isinstance(marsh.declared_fields[field], (Related, RelatedList)) or field in fields_to_include
-            }
-
-        data = marsh.dump(self, many=many)
-        data_list = [data]
-        if many:
-            data_list = data
-
-        for entry in data_list:
-            for k, v in self.extra_fields.items():
-                entry[k] = v
-
-        # Map keys using 'key_mapping'
-        for entry in data_list:
-            for key in list(entry.keys()):
-                if (out_key := key_mapping.get(key)):
-                    entry[out_key] = entry[key]
-                    del entry[key]
-
-        data = list(map(_fix_type, data_list))
-
-        return data if many else data[0]
-
-class User(Base):
-    __tablename__ = "users"
-
-    id: Mapped[str] = mapped_column(String(64), primary_key=True)
-    name: Mapped[str] = mapped_column(String(32), unique=True)
-    password: Mapped[str] = mapped_column(String(128))
-
-class AuthToken(Base):
-    __tablename__ = "auth_tokens"
-
-    holder_id: Mapped[str] = mapped_column(String(64), ForeignKey("users.id"))
-    token: Mapped[str] = mapped_column(String(64), primary_key=True)
-    expires: Mapped[int] = mapped_column(Integer, nullable=False)
-
-class Database:
-    def __init__(self, conn_str: str, add_user_tables: bool) -> None:
-        self.conn_str = conn_str
-        self.add_user_tables = add_user_tables
-        self._connections = {}
-
-    @property
-    def connection(self) -> Connection | Session | None:
-        return self._connections.get(get_ident())
-
-    @abstractmethod
-    def create_database_if_missing(self):
-        ...
-
-    @abstractmethod
-    def get_connection(self) -> Connection | Session | None:
-        ...
-
-    def close(self, thread_id: int):
-        self._connections[thread_id].close()
-        del self._connections[thread_id]
-        del self._nested_contexts[thread_id]
-
-def setup_pydantic_models():
-    for class_ in Base.__subclasses__():
-        if not hasattr(class_, "__tablename__"):
-            continue
-
-        # Create dynamic pydantic schema
-        validator_class_name = f"{class_.__name__}Validator"
-
-        fields = {}
-        for column in class_.__mapper__.columns:
-            field_dict = {
-                "validate_default": True if column.default is not None else False,
-                "title": column.name,
-                **class_.__validate_fields__.get(column.name, {}),
-            }
-
-            if column.default:
-                if isinstance(column.default, CallableColumnDefault):
-                    field_dict["default"] = column.default.arg(None)
-                else:
-                    field_dict["default"] = column.default.arg
-            elif column.nullable:
-                field_dict["default"] = None
-
-            field_type = column.type.python_type | None if column.nullable else column.type.python_type
-
-            if hasattr(column.type, "length") and not column.type.python_type.__base__ is Enum:
-                field_dict["max_length"] = column.type.length
-
-            fields[column.name] = (field_type, Field(**field_dict))
-
-        # Find any field validate functions the model may define
-        field_validators = {}
-        for key in class_.__dict__:
-            if (func_match := re.match(r"__(.+)_validator__", key)) and callable(class_.__dict__[key]):
-                field_validators[func_match[1]] = class_.__dict__[key]
-
-        validator_cls = create_model(validator_class_name, __base__=BaseModel, **fields)
-        setattr(class_, "__pydantic__", validator_cls)
-
-def setup_marshmallow_schemas(session):
-    # Create a function which incorporates the Base and session information
-    def setup_schema_fn():
-        for class_ in Base.__subclasses__():
-            if not hasattr(class_, "__tablename__"):
-                continue
-
-            # Create dynamic marshmallow schema
-            class Meta(object):
-                model = class_
-                sqla_session = session
-
-            schema_class_name = f"{class_.__name__}Schema"
-
-            # Add relationships as 'Related' fields
-            relations = {}
-            for relationship in class_.__serialize_relationships__:
-                name = relationship.key
-                related_class = relationship.entity.class_
-                cols = [col.name for col in related_class.__table__.columns]
-
-                if relationship.direction in (RelationshipDirection.ONETOMANY, RelationshipDirection.MANYTOMANY):
-                    relations[name] = RelatedList(RelatedExtra(cols))
-                else:
-                    relations[name] = RelatedExtra(cols)
-
-            schema_class = type(
-                schema_class_name, (SQLAlchemyAutoSchema,), {"Meta": Meta, **relations}
-            )
-
-            def fix_field(_, field_name, field_obj):
-                if isinstance(field_obj, MarshEnum):
-                    field_obj.by_value = True
-
-            schema_class.on_bind_field = fix_field
-
-            setattr(class_, "__marsh__", schema_class)
-
-    return setup_schema_fn
-
-event.listen(Mapper, "after_configured", setup_pydantic_models)
-
-def model_init(model, args, kwargs):
-    # Function that validates the model with pydantic before init
-    model.__pydantic__(**kwargs)
-
-class SQLAlchemyDatabase(Database):
-    def __init__(self, conn_str: str, models_folder: str, backup_path: str, autogenerate_schemas: bool = False, add_user_tables: bool = False) -> None:
-        super().__init__(conn_str, add_user_tables)
-
-        self.engine = create_engine(conn_str, pool_pre_ping=True)
-
-        self.models_folder = models_folder
-        self.backup_path = backup_path
-
-        self._sessionmaker = sessionmaker(bind=self.engine)
-        self._nested_contexts = {}
-        self._connections: Dict[int, Session] = {}
-
-        self.create_database_if_missing()
-
-        if autogenerate_schemas:
-            event.listen(Mapper, "after_configured", setup_marshmallow_schemas(self._sessionmaker()))
-
-            for class_ in Base.__subclasses__():
-                if hasattr(class_, "__tablename__"):
-                    event.listen(class_, "init", model_init)
-
-    def create_database_if_missing(self):
-        try:
-            with self.engine.connect():
-                pass
-
-        except SQLAOperationError as exc:
-            if f'database "{self.engine.url.database}" does not exist' in exc.args[0]:
-                url = self.engine.url.set(database="postgres")
-                engine = create_engine(url)
-
-                with engine.connect() as conn:
-                    conn.execution_options(isolation_level="AUTOCOMMIT")
-                    conn.execute(text(f"CREATE DATABASE {self.engine.url.database}"))
-                    conn.commit()
-
-                engine.dispose()
-
-        self._create_tables()
-
-    def create_backup(self):
-        args = ["pg_dump", self.engine.url.database]
-        with open(f"{self.backup_path}/pg_backup", "w") as fp:
-            Popen(args, stdout=fp, shell=True).wait()
-
-    def get_connection(self):
-        return self._sessionmaker()
-
-    def _create_tables(self):
-        if len(Base.metadata.tables) == 0:
-            self._import_models()
-
-        if not self.add_user_tables:
-            Base.metadata.remove(User.__table__)
-            Base.metadata.remove(AuthToken.__table__)
-
-        Base.metadata.create_all(bind=self.engine)
-
-    def _import_models(self):
-        package = ".".join(self.models_folder.split(os.sep))
-        for _, module_name, _ in pkgutil.walk_packages([self.models_folder], package + "."):
-            importlib.import_module(module_name.replace("/", "."), __package__)
-
-    def __enter__(self):
-        thread_id = get_ident()
-        nested_contexts = self._nested_contexts.get(thread_id, 0)
-        nested_contexts += 1
-        self._nested_contexts[thread_id] = nested_contexts
-
-        if thread_id in self._connections:
-            # Don't allow nested contexts.
-            return self._connections[thread_id]
-
-        self._connections[thread_id] = self.get_connection()
-        return self._connections[thread_id]
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        thread_id = get_ident()
-        nested_contexts = self._nested_contexts.get(thread_id, 1)
-        nested_contexts -= 1
-        self._nested_contexts[thread_id] = nested_contexts
-
-        if nested_contexts == 0:
-            self.close(thread_id)
-
-    def create_user(self, user_id: str, username: str , hashed_pass: str):
-        try:
-            with self as session:
-                session.add(User(id=user_id, name=username, password=hashed_pass))
-                session.commit()
-        except DatabaseError: # User already exists (unique constraint violated).
-            return False
-        return True
-
-    def password_matches(self, username: str, password: str):
-        with self as session:
-            stmt = select(User.password).filter(User.name == username)
-            try:
-                result = session.execute(stmt).scalar_one()
-            except Exception:
-                return False
-
-            return result == password
-
-    def get_user_id(self, username: str):
-        with self as session:
-            stmt = select(User.id).filter(User.name == username)
-            try:
-               return session.execute(stmt).scalar_one()
-            except Exception:
-                return None
-
-    def get_auth_token(self, user_id: str) -> str:
-        with self as session:
-            stmt = select(AuthToken.token).where(AuthToken.holder_id == user_id)
-            return session.execute(stmt).scalar_one()
-
-    def get_user_id_from_token(self, auth_token: str) -> Tuple[str, str] | None:
-        with self as session:
-            stmt = select(AuthToken.holder_id, User.name, AuthToken.expires).join(User).filter(AuthToken.token == auth_token)
-            result = session.execute(stmt).first()
-
-            if result is None:
-                return None
-
-            if result.t[2] < time():
-                delete_stmt = delete(AuthToken).where(AuthToken.token == auth_token)
-                session.execute(delete_stmt)
-                session.commit()
-
-                return None
-
-            return (result.t[0], result.t[1])
-
-    def save_auth_token(self, token: str, user_id: str, max_age: int):
-        with self as session:
-            expires = time() + max_age
-
-            session.add(AuthToken(holder_id=user_id, token=token, expires=int(expires)))
-
-            session.commit()
-
-class SQLiteDatabase(Database):
-    def __init__(self, conn_str: str, schema_file: str | None = None, add_user_tables: bool = False, row_factory=None):
-        super().__init__(conn_str, add_user_tables)
-        self.schema_file = schema_file
-        self.add_user_tables = add_user_tables
-        self._nested_contexts = {}
-        self._connections = {}
-        self._row_factory = row_factory
-
-        self.create_database_if_missing()
-
-    def get_connection(self):
-        conn = sqlite3.connect(self.conn_str)
-        conn.row_factory = self._row_factory
-        return conn
-
-    def create_database_if_missing(self):
-        if not os.path.exists(self.conn_str):
-            logger.info("Creating database from schema file.")
-            with self as session:
-                if self.schema_file is not None:
-                    # Initialize database with provided schema, if it exists.
-                    with open(self.schema_file, "r") as f:
-                        session.connection.cursor().executescript(f.read())
-
-                    session.connection.commit()
-
-                if self.add_user_tables:
-                    self.create_user_tables(session.connection)
-
-    def create_user_tables(self, conn):
-        conn.cursor().execute(
-            """
-            CREATE TABLE users (
-                id NVARCHAR(32) PRIMARY KEY,
-                name NVARCHAR(32) UNIQUE NOT NULL,
-                password NVARCHAR(64) NOT NULL
-            );
-            """
-        )
-        conn.commit()
-
-        conn.cursor().execute(
-            """
-            CREATE TABLE auth_tokens (
-                holder_id NVARCHAR(32) NOT NULL,
-                token NVARCHAR(64) PRIMARY KEY,
-                expires INTEGER NOT NULL
-            );
-            """
-        )
-        conn.commit()
-
-    def create_backup(self):
-        without_ext = self.conn_str.split(".")[0]
-        backup_name = f"{without_ext}_backup.db"
-        try:
-            # Remove old backup if it exists.
-            if os.path.exists(backup_name):
-                os.remove(backup_name)
-
-            copyfile(self.conn_str, backup_name)
-        except (OSError, IOError) as exc:
-            raise DBException(exc.args[0])
-
-    def query(self, query: str, *params, format_func=None, default=None):
-        return Query(query, *params, format_func=format_func, default=default, context=self)
-
-    def execute_query(self, query: str, *params, commit=True) -> Cursor:
-        """
-        Execute a query against the SQLite database.
-
-        :param query:   SQL query to be executed. Any '?' characters
-                        will be replaced by the given parameters
-        :param params:  Iterable of parameters to be added to the query
-        :param commit:  Whether to commit the SQLite transaction after
-                        the query has been executed
-        """
-        if self.connection is None:
-            raise DBException("No database connection is active.")
-
-        collected_params = []
-        for param in params:
-            if type(param) in (list, tuple):
-                collected_params.append(tuple(param))
-            else:
-                collected_params.append(param)
-
-        execute_many = collected_params != [] and all(isinstance(param, tuple) for param in collected_params)
-
-        if not execute_many:
-            collected_params = tuple(collected_params)
-
-        try:
-            if execute_many:
-                cursor = self.connection.cursor().executemany(query, collected_params)
-            else:
-                cursor = self.connection.cursor().execute(query, collected_params)
-
-            if commit:
-                self.connection.commit()
-
-            return cursor
-
-        except (OperationalError, ProgrammingError, DatabaseError) as exc:
-            raise DBException(exc.args)
-
-    def __enter__(self):
-        thread_id = get_ident()
-        nested_contexts = self._nested_contexts.get(thread_id, 0)
-        nested_contexts += 1
-        self._nested_contexts[thread_id] = nested_contexts
-
-        if thread_id in self._connections:
-            # Don't allow nested contexts.
-            return self
-
-        self._connections[thread_id] = self.get_connection()
-        return self
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        thread_id = get_ident()
-        nested_contexts = self._nested_contexts.get(thread_id, 1)
-        nested_contexts -= 1
-        self._nested_contexts[thread_id] = nested_contexts
-
-        if nested_contexts == 0:
-            self.close(thread_id)
-
-    def create_user(self, user_id, username, hashed_pass):
-        try:
-            with self as session:
-                query = "INSERT INTO users(id, name, password) VALUES (?, ?, ?)"
-                session.execute_query(query, user_id, username, hashed_pass)
-        except DatabaseError: # User already exists (unique constraint violated).
-            return False
-        return True
-
-    def password_matches(self, username, password):
-        with self as session:
-            query = "SELECT password FROM users WHERE name=?"
-            result = session.execute_query(query, username).fetchone()
-            if result is None:
-                return False
-
-            return result[0] == password
-
-    def get_user_id(self, username):
-        with self as session:
-            query = "SELECT id FROM users WHERE name=?"
-            result = session.execute_query(query, username).fetchone()
-            return result if result is None else result[0]
-
-    def get_user_id_from_token(self, auth_token: str) -> Tuple[str, str] | None:
-        with self as session:
-            query = """
-                SELECT
-                    at.holder_id,
-                    u.name,
-                    at.expires
-                FROM auth_tokens AS at
-                INNER JOIN users AS u
-                    ON u.id = at.holder_id
-                WHERE at.token = ?
-            """
-            result = session.execute_query(query, auth_token).fetchone()
-
-            if result is None:
-                return None
-            
-            expires = result[2]
-
-            if expires is None or expires < time():
-                # Token is expired
-                query_delete = "DELETE FROM auth_tokens WHERE token = ?"
-                session.execute_query(query_delete, auth_token)
-                return None
-
-            return result
-
-    def save_auth_token(self, token: str, user_id: str, max_age: int):
-        with self as session:
-            expires = time() + max_age
-            query = "INSERT INTO auth_tokens(holder_id, token, expires) VALUES (?, ?, ?)"
-            session.execute_query(query, user_id, token, int(expires))
+from enum import Enum
+from abc import abstractmethod
+import functools
+import importlib
+import os
+import pkgutil
+import re
+import sqlite3
+from shutil import copyfile
+from sqlite3 import ProgrammingError, OperationalError, DatabaseError, Connection, Cursor
+from subprocess import Popen
+from threading import local
+from time import time
+from typing import List, Tuple
+
+from marshmallow.fields import Enum as MarshEnum
+from marshmallow_sqlalchemy import SQLAlchemyAutoSchema, SQLAlchemySchema
+from marshmallow_sqlalchemy.fields import Related, RelatedList
+from sqlalchemy import Integer, bindparam, create_engine, String, ForeignKey, delete, event, select, text
+from sqlalchemy import inspect as sqla_inspect
+from sqlalchemy.orm import Session, Mapped, sessionmaker, DeclarativeBase, mapped_column, Mapper, RelationshipDirection, InstrumentedAttribute
+from sqlalchemy.sql.schema import CallableColumnDefault
+from sqlalchemy.exc import OperationalError as SQLAOperationError, DatabaseError as SQLADatabaseError
+from pydantic import create_model, Field, BaseModel
+from loguru import logger
+
+class DBException(OperationalError, ProgrammingError):
+    def __init__(self, *args):
+        super().__init__(args)
+
+def _format_unpack_one(cursor, default):
+    val = cursor.fetchone()
+    return default if val is None else val[0]
+
+_FORMAT_FUNCS = {
+    "all": lambda cursor, default: cursor.fetchall() or ([] if default is None else default),
+    "one": lambda cursor, default: cursor.fetchone() or default,
+    "unpack_all": lambda cursor, default: [x[0] for x in cursor] or ([] if default is None else default),
+    "unpack_one": _format_unpack_one,
+}
+
+class Query:
+    def __init__(self, query: str, *params, format_func = None, default = None, context = None):
+        collected_params = []
+        for param in params:
+            if type(param) in (list, tuple):
+                collected_params.append(tuple(param))
+            else:
+                collected_params.append(param)
+
+        execute_many = collected_params != [] and all(isinstance(param, tuple) for param in collected_params)
+
+        if not execute_many:
+            collected_params = tuple(collected_params)
+
+        self.params = collected_params
+        self.query = query
+        self.execute_many = execute_many
+        self.format_func = format_func
+        self.default = default
+        self.context = context
+
+    def __str__(self):
+        # Interleave query parts and parameters in one pass; repeated
+        # str.replace would allocate a new string per parameter and
+        # misbehave if a parameter itself contained a '?'.
+        parts = self.query.split("?")
+        out = [parts[0]]
+        for index, param in enumerate(self.params, 1):
+            if index >= len(parts):
+                break
+
+            out.append(str(param))
+            out.append(parts[index])
+
+        # With fewer params than placeholders, keep the rest of the
+        # query verbatim, unfilled '?'s included.
+        consumed = len(self.params) + 1
+        if consumed < len(parts):
+            out.append("?")
+            out.append("?".join(parts[consumed:]))
+
+        return "".join(out)
+
+    def __call__(self, commit: bool = True, raw: bool = False):
+        with self.context as context:
+            conn: Connection = context.connection
+            try:
+                if self.execute_many:
+                    cursor = conn.executemany(self.query, self.params)
+                else:
+                    cursor = conn.execute(self.query, self.params)
+
+                if commit:
+                    conn.commit()
+
+                if raw or self.format_func is None:
+                    return cursor
+
+                if callable(self.format_func):
+                    return self.format_func(cursor)
+
+                format_func = _FORMAT_FUNCS.get(self.format_func)
+                if format_func is None:
+                    raise ValueError("Formatting function for query is invalid.", self.format_func)
+
+                return format_func(cursor, self.default)
+
+            except (OperationalError, ProgrammingError, DatabaseError) as exc:
+                raise DBException(exc.args)
+
+class RelatedExtra(Related):
+    def _serialize(self, value, attr, obj):
+        if value is None:
+            return None
+
+        ret = {prop.key: getattr(value, prop.key, None) for prop in self.related_keys}
+        ret.update(value.extra_fields)
+        ret.update(value.dump())
+        return ret if len(ret) > 1 else next(iter(ret.values()))
+
+def _fix_types_inplace(data: dict):
+    # Replace Enum leaves with their values without rebuilding the
+    # surrounding dicts and lists.
+    for key, value in data.items():
+        if isinstance(value, Enum):
+            data[key] = value.value
+        elif isinstance(value, dict):
+            _fix_types_inplace(value)
+        elif isinstance(value, list):
+            _fix_list_inplace(value)
+
+def _fix_list_inplace(data: list):
+    for index, value in enumerate(data):
+        if isinstance(value, Enum):
+            data[index] = value.value
+        elif isinstance(value, dict):
+            _fix_types_inplace(value)
+        elif isinstance(value, list):
+            _fix_list_inplace(value)
+
+@functools.lru_cache(maxsize=None)
+def _schema_for_relations(schema_cls, relation_keys: tuple):
+    # Build (once per schema class and relation set) a schema instance
+    # whose dump_fields only keeps the requested 'Related' fields.
+    marsh = schema_cls()
+
+    fields_to_include = {
+        key for key in relation_keys
+        if key in marsh.declared_fields and isinstance(marsh.declared_fields[key], (Related, RelatedList))
+    }
+
+    marsh.dump_fields = {
+        field: marsh.declared_fields[field]
+        for field in marsh.declared_fields
+        if not isinstance(marsh.declared_fields[field], (Related, RelatedList)) or field in fields_to_include
+    }
+
+    return marsh
+
+class Base(DeclarativeBase):
+    __marsh__ = SQLAlchemySchema
+    __marsh_instance__ = None
+    __pydantic__ = BaseModel
+    __validate_fields__ = {}
+    __serialize_relationships__ = []
+
+    @property
+    def extra_fields(self):
+        return {}
+
+    def dump(self, many: bool | None = None, included_relations: List[InstrumentedAttribute] | None = None, **key_mapping):
+        if included_relations is not None:
+            relation_keys = tuple(sorted(relationship.key for relationship in included_relations))
+            marsh = _schema_for_relations(self.__marsh__, relation_keys)
+        elif self.__marsh_instance__ is not None:
+            marsh = self.__marsh_instance__
+        else:
+            marsh = self.__marsh__()
+
+        data = marsh.dump(self, many=many)
+        data_list = [data]
+        if many:
+            data_list = data
+
+        for entry in data_list:
+            for k, v in self.extra_fields.items():
+                entry[k] = v
+
+        # Map keys using 'key_mapping'
+        for entry in data_list:
+            for key in list(entry.keys()):
+                if (out_key := key_mapping.get(key)):
+                    entry[out_key] = entry[key]
+                    del entry[key]
+
+        for entry in data_list:
+            _fix_types_inplace(entry)
+
+        return data_list if many else data_list[0]
+
+class User(Base):
+    __tablename__ = "users"
+
+    id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    name: Mapped[str] = mapped_column(String(32), unique=True)
+    password: Mapped[str] = mapped_column(String(128))
+    # Hex-encoded per-user salt. Null for users created before salted hashing.
+    password_salt: Mapped[str] = mapped_column(String(32), nullable=True)
+
+class AuthToken(Base):
+    __tablename__ = "auth_tokens"
+
+    holder_id: Mapped[str] = mapped_column(String(64), ForeignKey("users.id"))
+    token: Mapped[str] = mapped_column(String(64), primary_key=True)
+    expires: Mapped[int] = mapped_column(Integer, nullable=False)
+
+# Precompiled statements for the hot auth read paths, built once at import.
+# Building a select() per call walks the expression tree and constructs a
+# compilation cache key every time, even though SQLAlchemy caches the SQL.
+_SEL_PASSWORD = select(User.password).where(User.name == bindparam("username"))
+_SEL_USER_ID = select(User.id).where(User.name == bindparam("username"))
+_SEL_AUTH_ROW = select(User.id, User.password, User.password_salt).where(User.name == bindparam("username"))
+_SEL_TOKEN = select(AuthToken.token).where(AuthToken.holder_id == bindparam("user_id"))
+_SEL_USER_FROM_TOKEN = (
+    select(AuthToken.holder_id, User.name)
+    .join(User)
+    .where(AuthToken.token == bindparam("token"))
+    .where(AuthToken.expires >= bindparam("now"))
+)
+
+class Database:
+    def __init__(self, conn_str: str, add_user_tables: bool) -> None:
+        self.conn_str = conn_str
+        self.add_user_tables = add_user_tables
+        # Per-thread connection state. threading.local attribute access is
+        # a C-level slot lookup, cheaper than dict lookups keyed on
+        # get_ident(), and is cleaned up automatically on thread exit.
+        self._tls = local()
+
+    @property
+    def connection(self) -> Connection | Session | None:
+        return getattr(self._tls, "conn", None)
+
+    @abstractmethod
+    def create_database_if_missing(self):
+        ...
+
+    @abstractmethod
+    def get_connection(self) -> Connection | Session | None:
+        ...
+
+    def close(self):
+        conn = getattr(self._tls, "conn", None)
+        if conn is not None:
+            conn.close()
+            del self._tls.conn
+
+        self._tls.nested = 0
+
+_VALIDATOR_RE = re.compile(r"__(.+)_validator__")
+
+def setup_pydantic_models():
+    for class_ in Base.__subclasses__():
+        if not hasattr(class_, "__tablename__"):
+            continue
+
+        if getattr(class_, "__pydantic_built__", False):
+            # Mappers can be reconfigured several times during import;
+            # only build the validator once per class.
+            continue
+
+        # Create dynamic pydantic schema
+        validator_class_name = f"{class_.__name__}Validator"
+
+        # Snapshot column metadata up front; python_type in particular goes
+        # through SQLAlchemy's lazy type resolution on every access.
+        columns = [
+            (column.name, column.type, column.nullable, column.default)
+            for column in class_.__mapper__.columns
+        ]
+
+        fields = {}
+        for name, col_type, nullable, default in columns:
+            python_type = col_type.python_type
+            length = getattr(col_type, "length", None)
+
+            field_dict = {
+                "validate_default": True if default is not None else False,
+                "title": name,
+                **class_.__validate_fields__.get(name, {}),
+            }
+
+            if default:
+                if isinstance(default, CallableColumnDefault):
+                    field_dict["default"] = default.arg(None)
+                else:
+                    field_dict["default"] = default.arg
+            elif nullable:
+                field_dict["default"] = None
+
+            field_type = python_type | None if nullable else python_type
+
+            if length is not None and not python_type.__base__ is Enum:
+                field_dict["max_length"] = length
+
+            fields[name] = (field_type, Field(**field_dict))
+
+        # Find any field validate functions the model may define
+        field_validators = {}
+        for key in class_.__dict__:
+            if (func_match := _VALIDATOR_RE.match(key)) and callable(class_.__dict__[key]):
+                field_validators[func_match[1]] = class_.__dict__[key]
+
+        validator_cls = create_model(validator_class_name, __base__=BaseModel, **fields)
+        setattr(class_, "__pydantic__", validator_cls)
+        class_.__pydantic_built__ = True
+
+def setup_marshmallow_schemas(session):
+    # Create a function which incorporates the Base and session information
+    def setup_schema_fn():
+        for class_ in Base.__subclasses__():
+            if not hasattr(class_, "__tablename__"):
+                continue
+
+            if getattr(class_, "__marsh_built__", False):
+                # Only build the schema class once; mapper reconfigure
+                # events can fire several times during import.
+                continue
+
+            # Create dynamic marshmallow schema
+            class Meta(object):
+                model = class_
+                sqla_session = session
+
+            schema_class_name = f"{class_.__name__}Schema"
+
+            # Add relationships as 'Related' fields
+            relations = {}
+            for relationship in class_.__serialize_relationships__:
+                name = relationship.key
+                related_class = relationship.entity.class_
+                cols = [col.name for col in related_class.__table__.columns]
+
+                if relationship.direction in (RelationshipDirection.ONETOMANY, RelationshipDirection.MANYTOMANY):
+                    relations[name] = RelatedList(RelatedExtra(cols))
+                else:
+                    relations[name] = RelatedExtra(cols)
+
+            schema_class = type(
+                schema_class_name, (SQLAlchemyAutoSchema,), {"Meta": Meta, **relations}
+            )
+
+            def fix_field(_, field_name, field_obj):
+                if isinstance(field_obj, MarshEnum):
+                    field_obj.by_value = True
+
+            schema_class.on_bind_field = fix_field
+
+            setattr(class_, "__marsh__", schema_class)
+            # Schemas are reusable across dump calls; instantiate once.
+            setattr(class_, "__marsh_instance__", schema_class())
+            class_.__marsh_built__ = True
+
+    return setup_schema_fn
+
+event.listen(Mapper, "after_configured", setup_pydantic_models)
+
+def model_init(model, args, kwargs):
+    # Function that validates the model with pydantic before init
+    model.__pydantic__(**kwargs)
+
+class SQLAlchemyDatabase(Database):
+    def __init__(self, conn_str: str, models_folder: str, backup_path: str, autogenerate_schemas: bool = False, add_user_tables: bool = False) -> None:
+        super().__init__(conn_str, add_user_tables)
+
+        self.engine = create_engine(conn_str, pool_pre_ping=True)
+
+        self.models_folder = models_folder
+        self.backup_path = backup_path
+
+        self._sessionmaker = sessionmaker(bind=self.engine)
+
+        self.create_database_if_missing()
+
+        if autogenerate_schemas:
+            event.listen(Mapper, "after_configured", setup_marshmallow_schemas(self._sessionmaker()))
+
+            for class_ in Base.__subclasses__():
+                if hasattr(class_, "__tablename__"):
+                    event.listen(class_, "init", model_init)
+
+    def create_database_if_missing(self):
+        try:
+            with self.engine.connect():
+                pass
+
+        except SQLAOperationError as exc:
+            if f'database "{self.engine.url.database}" does not exist' in exc.args[0]:
+                url = self.engine.url.set(database="postgres")
+                engine = create_engine(url)
+
+                with engine.connect() as conn:
+                    conn.execution_options(isolation_level="AUTOCOMMIT")
+                    conn.execute(text(f"CREATE DATABASE {self.engine.url.database}"))
+                    conn.commit()
+
+                engine.dispose()
+
+        self._create_tables()
+
+    def create_backup(self):
+        args = ["pg_dump", self.engine.url.database]
+        with open(f"{self.backup_path}/pg_backup", "w") as fp:
+            Popen(args, stdout=fp, shell=True).wait()
+
+    def get_connection(self):
+        return self._sessionmaker()
+
+    def _create_tables(self):
+        if len(Base.metadata.tables) == 0:
+            self._import_models()
+
+        if not self.add_user_tables:
+            Base.metadata.remove(User.__table__)
+            Base.metadata.remove(AuthToken.__table__)
+
+        Base.metadata.create_all(bind=self.engine)
+
+        if self.add_user_tables:
+            self._add_missing_user_columns()
+
+    def _add_missing_user_columns(self):
+        # create_all never alters existing tables, so databases created
+        # before per-user salts were introduced lack the column.
+        inspector = sqla_inspect(self.engine)
+        columns = [column["name"] for column in inspector.get_columns(User.__tablename__)]
+
+        if "password_salt" not in columns:
+            with self.engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {User.__tablename__} ADD COLUMN password_salt VARCHAR(32)"))
+
+    def _import_models(self):
+        package = ".".join(self.models_folder.split(os.sep))
+        for _, module_name, _ in pkgutil.walk_packages([self.models_folder], package + "."):
+            importlib.import_module(module_name.replace("/", "."), __package__)
+
+    def __enter__(self):
+        nested_contexts = getattr(self._tls, "nested", 0)
+        self._tls.nested = nested_contexts + 1
+
+        if nested_contexts == 0:
+            self._tls.conn = self.get_connection()
+
+        # Don't allow nested contexts.
+        return self._tls.conn
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        nested_contexts = getattr(self._tls, "nested", 1)
+        nested_contexts -= 1
+        self._tls.nested = nested_contexts
+
+        if nested_contexts == 0:
+            self.close()
+
+    def create_user(self, user_id: str, username: str , hashed_pass: str, password_salt: str | None = None):
+        try:
+            with self as session:
+                session.add(User(id=user_id, name=username, password=hashed_pass, password_salt=password_salt))
+                session.commit()
+        except SQLADatabaseError: # User already exists (unique constraint violated).
+            return False
+        return True
+
+    def create_user_with_token(self, user_id: str, username: str, hashed_pass: str, password_salt: str | None, token: str, max_age: int):
+        try:
+            with self as session:
+                expires = int(time() + max_age)
+                session.add_all([
+                    User(id=user_id, name=username, password=hashed_pass, password_salt=password_salt),
+                    AuthToken(holder_id=user_id, token=token, expires=expires),
+                ])
+                session.commit()
+        except SQLADatabaseError: # User already exists (unique constraint violated).
+            return False
+        return True
+
+    def password_matches(self, username: str, password: str):
+        with self.engine.connect() as conn:
+            result = conn.execute(_SEL_PASSWORD, {"username": username}).scalar()
+
+        return result is not None and result == password
+
+    def get_user_id(self, username: str):
+        with self.engine.connect() as conn:
+            return conn.execute(_SEL_USER_ID, {"username": username}).scalar()
+
+    def get_user_auth_row(self, username: str) -> Tuple[str, str, str | None] | None:
+        with self.engine.connect() as conn:
+            result = conn.execute(_SEL_AUTH_ROW, {"username": username}).first()
+
+        return None if result is None else result.t
+
+    def get_auth_token(self, user_id: str) -> str:
+        with self.engine.connect() as conn:
+            return conn.execute(_SEL_TOKEN, {"user_id": user_id}).scalar_one()
+
+    def get_user_id_from_token(self, auth_token: str) -> Tuple[str, str] | None:
+        with self.engine.connect() as conn:
+            result = conn.execute(
+                _SEL_USER_FROM_TOKEN, {"token": auth_token, "now": int(time())}
+            ).first()
+
+        return None if result is None else (result.t[0], result.t[1])
+
+    def cleanup_expired_tokens(self):
+        """
+        Bulk-delete auth tokens that have expired. Meant to be called from
+        a periodic task; expired tokens are already filtered out of lookups.
+        """
+        with self.engine.begin() as conn:
+            conn.execute(delete(AuthToken).where(AuthToken.expires < int(time())))
+
+    def save_auth_token(self, token: str, user_id: str, max_age: int):
+        with self as session:
+            expires = time() + max_age
+
+            session.add(AuthToken(holder_id=user_id, token=token, expires=int(expires)))
+
+            session.commit()
+
+class SQLiteDatabase(Database):
+    def __init__(self, conn_str: str, schema_file: str | None = None, add_user_tables: bool = False, row_factory=None):
+        super().__init__(conn_str, add_user_tables)
+        self.schema_file = schema_file
+        self.add_user_tables = add_user_tables
+        self._row_factory = row_factory
+
+        self.create_database_if_missing()
+
+        if self.add_user_tables:
+            self._add_missing_user_columns()
+
+    def get_connection(self):
+        conn = sqlite3.connect(self.conn_str)
+        conn.row_factory = self._row_factory
+
+        # Tune SQLite for web-app style usage. WAL avoids an fsync per
+        # INSERT and lets readers run concurrently with a writer.
+        conn.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA mmap_size=268435456;
+            PRAGMA cache_size=-65536;
+            """
+        )
+
+        return conn
+
+    def create_database_if_missing(self):
+        if not os.path.exists(self.conn_str):
+            logger.info("Creating database from schema file.")
+            with self as session:
+                if self.schema_file is not None:
+                    # Initialize database with provided schema, if it exists.
+                    with open(self.schema_file, "r") as f:
+                        session.connection.cursor().executescript(f.read())
+
+                    session.connection.commit()
+
+                if self.add_user_tables:
+                    self.create_user_tables(session.connection)
+
+    def _add_missing_user_columns(self):
+        # create_database_if_missing doesn't touch existing files, so
+        # databases created before per-user salts lack the column.
+        # A plain connection is used so a custom row factory can't
+        # change the shape of the PRAGMA rows.
+        conn = sqlite3.connect(self.conn_str)
+        try:
+            with conn:
+                columns = [row[1] for row in conn.execute("PRAGMA table_info(users)")]
+                if columns and "password_salt" not in columns:
+                    conn.execute("ALTER TABLE users ADD COLUMN password_salt NVARCHAR(32)")
+        finally:
+            conn.close()
+
+    def create_user_tables(self, conn):
+        conn.cursor().execute(
+            """
+            CREATE TABLE users (
+                id NVARCHAR(32) PRIMARY KEY,
+                name NVARCHAR(32) UNIQUE NOT NULL,
+                password NVARCHAR(64) NOT NULL,
+                password_salt NVARCHAR(32)
+            );
+            """
+        )
+        conn.commit()
+
+        conn.cursor().execute(
+            """
+            CREATE TABLE auth_tokens (
+                holder_id NVARCHAR(32) NOT NULL,
+                token NVARCHAR(64) PRIMARY KEY,
+                expires INTEGER NOT NULL
+            );
+            """
+        )
+        conn.commit()
+
+        # Index for holder-based lookups and the join in get_user_id_from_token.
+        conn.cursor().execute("CREATE INDEX idx_auth_tokens_holder ON auth_tokens(holder_id);")
+        conn.commit()
+
+    def create_backup(self):
+        without_ext = self.conn_str.split(".")[0]
+        backup_name = f"{without_ext}_backup.db"
+        try:
+            # Remove old backup if it exists.
+            if os.path.exists(backup_name):
+                os.remove(backup_name)
+
+            copyfile(self.conn_str, backup_name)
+        except (OSError, IOError) as exc:
+            raise DBException(exc.args[0])
+
+    def query(self, query: str, *params, format_func=None, default=None):
+        return Query(query, *params, format_func=format_func, default=default, context=self)
+
+    def execute_query(self, query: str, *params, commit=True) -> Cursor:
+        """
+        Execute a query against the SQLite database.
+
+        :param query:   SQL query to be executed. Any '?' characters
+                        will be replaced by the given parameters
+        :param params:  Iterable of parameters to be added to the query
+        :param commit:  Whether to commit the SQLite transaction after
+                        the query has been executed
+        """
+        if self.connection is None:
+            raise DBException("No database connection is active.")
+
+        collected_params = []
+        for param in params:
+            if type(param) in (list, tuple):
+                collected_params.append(tuple(param))
+            else:
+                collected_params.append(param)
+
+        execute_many = collected_params != [] and all(isinstance(param, tuple) for param in collected_params)
+
+        if not execute_many:
+            collected_params = tuple(collected_params)
+
+        try:
+            if execute_many:
+                cursor = self.connection.executemany(query, collected_params)
+            else:
+                cursor = self.connection.execute(query, collected_params)
+
+            if commit:
+                self.connection.commit()
+
+            return cursor
+
+        except (OperationalError, ProgrammingError, DatabaseError) as exc:
+            raise DBException(exc.args)
+
+    def execute_batch(self, query: str, param_iter) -> Cursor:
+        """
+        Execute a query once per parameter tuple in a single transaction.
+
+        Much faster than calling 'execute_query' in a loop, as the whole
+        batch is committed (and synced to disk) only once.
+
+        :param query:       SQL query to be executed. Any '?' characters
+                            will be replaced by the given parameters
+        :param param_iter:  Iterable of parameter tuples, one per execution
+        """
+        if self.connection is None:
+            raise DBException("No database connection is active.")
+
+        try:
+            with self.connection:
+                return self.connection.executemany(query, param_iter)
+
+        except (OperationalError, ProgrammingError, DatabaseError) as exc:
+            raise DBException(exc.args)
+
+    def __enter__(self):
+        self._tls.nested = getattr(self._tls, "nested", 0) + 1
+
+        if getattr(self._tls, "conn", None) is None:
+            self._tls.conn = self.get_connection()
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._tls.nested = getattr(self._tls, "nested", 1) - 1
+
+        # An exception may leave uncommitted statements behind. Since
+        # the connection outlives the context, roll them back here so
+        # they can't ride along with the next commit on this thread.
+        if exc_type is not None:
+            conn = getattr(self._tls, "conn", None)
+            if conn is not None:
+                conn.rollback()
+
+        # The connection is deliberately kept open when the outermost
+        # context exits. Opening a SQLite database is not free (file lock,
+        # header parse, cold page cache), so each thread reuses its
+        # connection for the lifetime of the thread. Call close() to tear
+        # a connection down explicitly.
+
+    def create_user(self, user_id, username, hashed_pass, password_salt=None):
+        try:
+            with self as session:
+                query = "INSERT INTO users(id, name, password, password_salt) VALUES (?, ?, ?, ?)"
+                session.execute_query(query, user_id, username, hashed_pass, password_salt)
+        except DatabaseError: # User already exists (unique constraint violated).
+            return False
+        return True
+
+    def create_user_with_token(self, user_id, username, hashed_pass, password_salt, token, max_age):
+        try:
+            with self as session:
+                expires = int(time() + max_age)
+                query_user = "INSERT INTO users(id, name, password, password_salt) VALUES (?, ?, ?, ?)"
+                query_token = "INSERT INTO auth_tokens(holder_id, token, expires) VALUES (?, ?, ?)"
+
+                # Both inserts share one transaction and a single commit.
+                session.execute_query(query_user, user_id, username, hashed_pass, password_salt, commit=False)
+                session.execute_query(query_token, user_id, token, expires)
+        except DatabaseError: # User already exists (unique constraint violated).
+            # Discard the pending user INSERT if the token INSERT was
+            # the one that failed; the connection stays open, so left
+            # as-is it would be committed by the next write.
+            conn = self.connection
+            if conn is not None:
+                conn.rollback()
+            return False
+        return True
+
+    def password_matches(self, username, password):
+        with self as session:
+            query = "SELECT password FROM users WHERE name=?"
+            result = session.execute_query(query, username).fetchone()
+            if result is None:
+                return False
+
+            return result[0] == password
+
+    def get_user_id(self, username):
+        with self as session:
+            query = "SELECT id FROM users WHERE name=?"
+            result = session.execute_query(query, username).fetchone()
+            return result if result is None else result[0]
+
+    def get_user_auth_row(self, username) -> Tuple[str, str, str | None] | None:
+        with self as session:
+            query = "SELECT id, password, password_salt FROM users WHERE name=?"
+            return session.execute_query(query, username).fetchone()
+
+    def get_user_id_from_token(self, auth_token: str) -> Tuple[str, str] | None:
+        with self as session:
+            query = """
+                SELECT
+                    at.holder_id,
+                    u.name
+                FROM auth_tokens AS at
+                INNER JOIN users AS u
+                    ON u.id = at.holder_id
+                WHERE at.token = ?
+                    AND at.expires >= ?
+            """
+            return session.execute_query(query, auth_token, int(time())).fetchone()
+
+    def cleanup_expired_tokens(self):
+        """
+        Bulk-delete auth tokens that have expired. Meant to be called from
+        a periodic task; expired tokens are already filtered out of lookups.
+        """
+        with self as session:
+            query = "DELETE FROM auth_tokens WHERE expires < ?"
+            session.execute_query(query, int(time()))
+
+    def save_auth_token(self, token: str, user_id: str, max_age: int):
+        with self as session:
+            expires = time() + max_age
+            query = "INSERT INTO auth_tokens(holder_id, token, expires) VALUES (?, ?, ?)"
+            session.execute_query(query, user_id, token, int(expires))
@@ -5,10 +5,12 @@ import os
 from dataclasses import dataclass
 from abc import ABC, abstractmethod
 from typing import Any, Dict
+from gevent.pool import Pool
 from gevent.pywsgi import WSGIServer
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 from flask import Flask
+from jinja2 import TemplateError
 from loguru import logger
 
 from flask_cors import CORS
@@ -18,6 +20,62 @@ from . import logging
 from . import routing
 from .database import Database
 
+def _cached_import(module_name, attr=None):
+    """
+    Import a module, peeking sys.modules first to skip the import
+    machinery (dotted-path resolution, import lock) for cached hits.
+    Returns the module, or the named attribute of it if 'attr' is given.
+    """
+    module = sys.modules.get(module_name)
+    if module is None:
+        module = importlib.import_module(module_name)
+
+    return module if attr is None else getattr(module, attr)
+
+class LazyBlueprint:
+    """
+    Proxy for a Flask blueprint that defers importing its route module
+    until the blueprint is actually used. Flask needs the URL rules at
+    registration time, so the import cannot be deferred past
+    register_blueprint, but modules for blueprints that never get
+    registered are never imported at all, and imports happen lazily
+    during registration instead of eagerly in a separate pass.
+    """
+    def __init__(self, module_name: str, attr: str):
+        # Avoid __setattr__ recursion through __getattr__.
+        object.__setattr__(self, "_module_name", module_name)
+        object.__setattr__(self, "_attr", attr)
+        object.__setattr__(self, "_blueprint", None)
+
+    def _resolve(self):
+        if self._blueprint is None:
+            object.__setattr__(self, "_blueprint", _cached_import(self._module_name, self._attr))
+
+        return self._blueprint
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+def _blueprint_needs_tree(blueprint) -> bool:
+    """
+    Whether a parent blueprint has request-lifecycle handlers that must
+    apply to its children, in which case the children have to stay
+    nested under it. Blueprints without any are flattened onto the app.
+    """
+    # Every blueprint carries Flask's default template context processor,
+    # so only count processors beyond that one.
+    context_processors = sum(map(len, blueprint.template_context_processors.values()))
+
+    return any((
+        blueprint.before_request_funcs,
+        blueprint.after_request_funcs,
+        blueprint.teardown_request_funcs,
+        blueprint.url_value_preprocessors,
+        blueprint.url_default_functions,
+        context_processors > 1,
+        blueprint.error_handler_spec,
+    ))
+
 @dataclass
 class Route:
     route: str
@@ -42,10 +100,17 @@ class ServerWrapper(ABC):
         ...
 
 class WSGIServerWrapper(ServerWrapper):
+    # Cap on concurrent request greenlets. Without it gevent spawns an
+    # unbounded greenlet per connection, which under burst load blows up
+    # memory instead of applying backpressure. Matches the gunicorn
+    # worker_connections default.
+    worker_connections = 1000
+
     def create_handler(self):
         return WSGIServer(
             (self.host, self.port),
             self.app,
+            spawn=Pool(self.worker_connections),
             log=logging.WSGI_INFO_LOGGER,
             error_log=logging.WSGI_ERROR_LOGGER,
         )
@@ -139,25 +204,26 @@ def create_app(
         )
 
     # Set up the blueprints for all the pages/routes.
-    route_modules = {}
-    root_module = root_folder.replace("\\", "/").replace("/", ".")
+    route_blueprints = {}
+    # Tokenize the root folder once; each module path below is then a
+    # single str.join instead of repeated f-string concatenation.
+    module_parts = tuple(root_folder.replace("\\", "/").split("/"))
     for route in routes:
-        name = route.route
-        path = route.folder
-        route_modules[route.blueprint] = importlib.import_module(f"{root_module}.{path}.{name}")
+        module_name = ".".join(module_parts + (route.folder, route.route))
+        route_blueprints[route.blueprint] = LazyBlueprint(module_name, route.blueprint)
 
         if route.parent_route is not None:
-            name = route.parent_route.route
-            path = route.parent_route.folder
+            parent_route = route.parent_route
 
-            if route.parent_route.blueprint not in route_modules:
-                route_modules[route.parent_route.blueprint] = importlib.import_module(f"{root_module}.{path}.{name}")
+            if parent_route.blueprint not in route_blueprints:
+                module_name = ".".join(module_parts + (parent_route.folder, parent_route.route))
+                route_blueprints[parent_route.blueprint] = LazyBlueprint(module_name, parent_route.blueprint)
 
     parent_blueprints = set()
 
     # Register blueprints for all the pages/routes.
     for route in routes:
-        module = route_modules[route.blueprint]
+        blueprint = route_blueprints[route.blueprint]
         if route.parent_route is None:
             prefix = root if route.prefix == "root" else f"{root}{route.prefix}"
         else:
@@ -165,21 +231,42 @@ def create_app(
 
         if route.parent_route is not None:
             parent_route = route.parent_route
-            parent_module = route_modules[parent_route.blueprint]
             parent_prefix = root if parent_route.prefix == "root" else f"{root}{parent_route.prefix}"
-            parent = getattr(parent_module, parent_route.blueprint)
+            parent = route_blueprints[parent_route.blueprint]
             parent_blueprints.add((parent, parent_prefix))
 
+            if not _blueprint_needs_tree(parent):
+                # The parent has no lifecycle handlers, so nesting only
+                # buys prefixed URLs and endpoint names. Register the
+                # child directly on the app with the combined prefix and
+                # the dotted name; Flask then walks the rules once
+                # instead of re-merging them when the parent registers.
+                if prefix is None:
+                    combined_prefix = parent_prefix
+                else:
+                    # Join the way Flask's nested registration does, so
+                    # prefixes without a leading slash keep their URLs.
+                    combined_prefix = f"{parent_prefix.rstrip('/')}/{prefix.lstrip('/')}"
+                web_app.register_blueprint(
+                    blueprint,
+                    url_prefix=combined_prefix,
+                    name=f"{parent.name}.{blueprint.name}"
+                )
+                continue
+
         else:
             parent = web_app
 
-        blueprint = getattr(module, route.blueprint)
-
         parent.register_blueprint(blueprint, url_prefix=prefix)
 
     for blueprint, prefix in parent_blueprints:
         web_app.register_blueprint(blueprint, url_prefix=prefix)
 
+    # Werkzeug batches URL-map rebuilds already: add() only flags the map
+    # and the compile/sort runs once, lazily, on the first match. Run it
+    # now so the first request doesn't pay for it.
+    web_app.url_map.update()
+
     # Set up Flask lifetime variables.
     for key in kw_config:
         web_app.config[key.upper()] = kw_config[key]
@@ -189,6 +276,7 @@ def create_app(
     # Set up miscellaneous stuff
     web_app.config["DATABASE"] = database
     web_app.config["PERSISTENT_DATA"] = persistent_variables
+    routing._persistent_data = persistent_variables
     web_app.config["APP_ENV"] = "production" if sys.platform == "linux" else "dev"
     web_app.config["SECRET_FILE"] = secret_file
     web_app.config["_SERVER_CLS"] = server_cls
@@ -206,6 +294,17 @@ def create_app(
     if server_cls is SocketIOServerWrapper:
         routing.socket_io.init_app(web_app)
 
+    # Templates don't change under a running production app, so compile
+    # them all now. Renders then hit the in-memory template cache instead
+    # of stat'ing every blueprint's template folder on first use.
+    if web_app.config["APP_ENV"] == "production":
+        web_app.jinja_env.auto_reload = False
+        for template_name in web_app.jinja_env.list_templates(extensions=("html",)):
+            try:
+                web_app.jinja_env.get_template(template_name)
+            except TemplateError:
+                logger.warning(f"Template '{template_name}' failed to compile during preload.")
+
     return web_app
 
 def run_app(app: Flask, app_name: str, port: int, host: str = ""):
@@ -223,3 +322,4 @@ def run_app(app: Flask, app_name: str, port: int, host: str = ""):
 
 def set_persistent_data(app: Flask, data):
     app.config["PERSISTENT_DATA"] = data
+    routing._persistent_data = data
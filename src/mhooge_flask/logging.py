@@ -1,3 +1,4 @@
+import io
 import os
 import sys
 import re
@@ -6,25 +7,31 @@ import logging as stdlib_logging
 
 from loguru import logger
 
+_SSL_ERROR_RE = re.compile(r"ssl\..*Error")
+
 class StdErrRedirect(object):
     def __init__(self, stderr_stream):
         self.stderr_stream = stderr_stream
         self.prev_msg_handshake = False
-        self.gevent_error_lines = []
+        # Pending gevent/SSL traceback lines, accumulated in a StringIO
+        # instead of a list that gets re-joined on every dispatch.
+        self._error_buffer = io.StringIO()
 
     def write(self, msg):
-        ssl_error = re.search(r"ssl\..*Error", msg) is not None
+        ssl_error = _SSL_ERROR_RE.search(msg) is not None
 
-        if ssl_error or self.gevent_error_lines != []:
+        if ssl_error or self._error_buffer.tell() > 0:
             if "self._sslobj.do_handshake()" in msg:
                 self.prev_msg_handshake = True
 
             if self.prev_msg_handshake:
-                joined = "\n".join(self.gevent_error_lines)
-                WSGI_ERROR_LOGGER.write(joined, ssl_error=True)
-                self.gevent_error_lines = []
+                WSGI_ERROR_LOGGER.write(self._error_buffer.getvalue(), ssl_error=True)
+                self._error_buffer.seek(0)
+                self._error_buffer.truncate()
             else:
-                self.gevent_error_lines.append(msg.replace("\n", ""))
+                if self._error_buffer.tell() > 0:
+                    self._error_buffer.write("\n")
+                self._error_buffer.write(msg.replace("\n", ""))
         else:
            self.stderr_stream.write(msg)
 
@@ -36,9 +43,19 @@ class StdErrRedirect(object):
     def close(self):
         self.stderr_stream.close()
 
+# Record kinds, bound as the '_kind' extra on every record. The sink
+# filters compare these ints instead of testing dict membership of
+# several extra keys per record per sink. Application records get the
+# default kind from logger.configure in initialize_logging.
+_KIND_APP = 0
+_KIND_WSGI_INFO = 1
+_KIND_WSGI_ERROR = 2
+_KIND_IGNORE = 3
+
 class WSGILogger(object):
     def __init__(self, level):
         self.level = level
+        self._kind = _KIND_WSGI_INFO if level == WSGI_INFO_LEVEL else _KIND_WSGI_ERROR
 
     def write(self, msg, **bindings):
         if msg and msg.endswith('\n'):
@@ -63,9 +80,7 @@ class WSGILogger(object):
             except ValueError:
                 pass
 
-        bindings["wsgi"] = self.level
-
-        logger.bind(**bindings).log(self.level, msg)
+        logger.bind(_kind=self._kind, **bindings).log(self.level, msg)
 
     def close(self):
         super().close()
@@ -77,6 +92,18 @@ class SocketIOLoggingHandler(stdlib_logging.Handler):
     _RECIEVE_EVENTS_TO_FILER = ["calculate_ping", "ping_request"]
     _EMIT_EVENTS_TO_FILTER = ["ping_calculated", "ping_response"]
 
+    # One alternation pattern per direction, compiled once at class
+    # creation, instead of building and compiling a pattern per event
+    # on every log record.
+    _RECIEVE_FILTER_RE = re.compile(
+        rf'^received event "(?:{"|".join(_RECIEVE_EVENTS_TO_FILER)})"'
+        rf'|Received packet MESSAGE data .+\,\[\"(?:{"|".join(_RECIEVE_EVENTS_TO_FILER)})\"'
+    )
+    _EMIT_FILTER_RE = re.compile(
+        rf'^emitting event "(?:{"|".join(_EMIT_EVENTS_TO_FILTER)})"'
+        rf'|Sending packet MESSAGE data .+\,\[\"(?:{"|".join(_EMIT_EVENTS_TO_FILTER)})\"'
+    )
+
     def emit(self, record: stdlib_logging.LogRecord) -> None:
         message = record.getMessage()
 
@@ -84,15 +111,9 @@ class SocketIOLoggingHandler(stdlib_logging.Handler):
         if "Sending packet PING data" in message or "Received packet PONG data" in message:
             return
 
-        # Filter custom recieve events
-        for event in SocketIOLoggingHandler._RECIEVE_EVENTS_TO_FILER:
-            if message.startswith(f'received event "{event}"') or re.search(rf'Received packet MESSAGE data .+\,\[\"{event}\"', message) is not None:
-                return
-
-        # Filter custom emit events
-        for event in SocketIOLoggingHandler._EMIT_EVENTS_TO_FILTER:
-            if message.startswith(f'emitting event "{event}"') or re.search(rf'Sending packet MESSAGE data .+\,\[\"{event}\"', message) is not None:
-                return
+        # Filter custom recieve/emit events
+        if self._RECIEVE_FILTER_RE.search(message) or self._EMIT_FILTER_RE.search(message):
+            return
 
         # Get corresponding Loguru level if it exists.
         level: str | int
@@ -134,7 +155,38 @@ WSGI_ERROR_LEVEL = "WSGI_ERROR"
 
 WSGI_ERROR_FILE = f"{LOG_FOLDER}/wsgi_error.log"
 
+# Level numbers, bound once in initialize_logging. Loguru runs every
+# sink's filter for every record, so the filters below are plain named
+# functions comparing against these constants instead of per-sink
+# lambdas that re-resolve logger.level(...) on each record.
+_WARNING_NO = 30
+_INFO_NO = 20
+_WSGI_ERROR_NO = 41
+
+def _filter_wsgi_stdout(record):
+    return record["level"].no < _WARNING_NO
+
+def _filter_wsgi_error_file(record):
+    # .get rather than indexing: logger.configure(extra=...) replaces
+    # the whole extra dict, so an app reconfiguring extras would
+    # otherwise break every sink filter with a KeyError.
+    return record["extra"].get("_kind", _KIND_APP) in (_KIND_WSGI_INFO, _KIND_WSGI_ERROR)
+
+def _filter_app_stdout_info(record):
+    return record["level"].no <= _INFO_NO
+
+def _filter_app_stdout_warning(record):
+    return record["level"].no < _WSGI_ERROR_NO
+
+def _filter_app_stderr(record):
+    return "ssl_error" not in record["extra"]
+
+def _filter_app_file(record):
+    return record["extra"].get("_kind", _KIND_APP) == _KIND_APP
+
 def initialize_logging():
+    global _WARNING_NO, _INFO_NO, _WSGI_ERROR_NO
+
     try:
         # Tests if logger has been initialized already.
         logger.level(WSGI_INFO_LEVEL)
@@ -153,6 +205,10 @@ def initialize_logging():
 
     logger.remove()
 
+    # Default every record to the application kind; WSGI and ignored
+    # records override it via logger.bind.
+    logger.configure(extra={"_kind": _KIND_APP})
+
     # Redirect stderr to class for more control.
     stderr_stream = sys.stderr
     sys.stderr = StdErrRedirect(stderr_stream)
@@ -162,11 +218,15 @@ def initialize_logging():
     logger.level(WSGI_ERROR_LEVEL, no=41, color="<red>")
     logger.level("WARNING", color="<yellow>")
 
+    _WARNING_NO = logger.level("WARNING").no
+    _INFO_NO = logger.level("INFO").no
+    _WSGI_ERROR_NO = logger.level(WSGI_ERROR_LEVEL).no
+
     # Add WSGI stdout debug logger.
     logger.add(
         sys.stdout,
         level=WSGI_INFO_LEVEL,
-        filter=lambda record: record["level"].no < logger.level("WARNING").no,
+        filter=_filter_wsgi_stdout,
         colorize=True,
         format=wsgi_info_format
     )
@@ -175,7 +235,7 @@ def initialize_logging():
     logger.add(
         WSGI_ERROR_FILE,
         level=WSGI_ERROR_LEVEL,
-        filter=lambda record: "wsgi" in record["extra"] and "ignore" not in record["extra"],
+        filter=_filter_wsgi_error_file,
         rotation=MAX_LOG_SIZE,
         format=wsgi_error_format,
         retention="1 month",
@@ -187,7 +247,7 @@ def initialize_logging():
     logger.add(
         sys.stdout,
         level="INFO",
-        filter=lambda record: record["level"].no <= logger.level("INFO").no,
+        filter=_filter_app_stdout_info,
         colorize=True,
         format=app_info_format
     )
@@ -196,7 +256,7 @@ def initialize_logging():
     logger.add(
         sys.stdout,
         level="WARNING",
-        filter=lambda record: record["level"].no < logger.level(WSGI_ERROR_LEVEL).no,
+        filter=_filter_app_stdout_warning,
         colorize=True,
         format=app_warning_format
     )
@@ -205,7 +265,7 @@ def initialize_logging():
     logger.add(
         stderr_stream,
         level="ERROR",
-        filter=lambda record: "ssl_error" not in record["extra"],
+        filter=_filter_app_stderr,
         colorize=True,
         format=error_format
     )
@@ -214,7 +274,7 @@ def initialize_logging():
     logger.add(
         APPLICATION_LOG_FILE,
         level="DEBUG",
-        filter=lambda record: "wsgi" not in record["extra"] and "ignore" not in record["extra"],
+        filter=_filter_app_file,
         rotation=MAX_LOG_SIZE,
         retention="1 month",
         encoding="utf-8",
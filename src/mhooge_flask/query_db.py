@@ -1,5 +1,8 @@
 from time import time
+import functools
 import json
+import re
+import sys
 from sqlite3 import Connection, OperationalError, ProgrammingError, Cursor
 from typing import List, Tuple
 from sqlalchemy import Result, text
@@ -8,27 +11,43 @@ from sqlalchemy.exc import ResourceClosedError
 
 from mhooge_flask.database import Query, Database
 
+@functools.lru_cache(maxsize=256)
+def _compiled_text(query: str):
+    # text() builds a TextClause; cache it so repeated REPL queries
+    # don't re-parse the same SQL string.
+    return text(query)
+
+@functools.lru_cache(maxsize=None)
+def _resolve_query_method(db_cls, name):
+    return getattr(db_cls, name, None)
+
+_LITERALS = {"None": None, "True": True, "False": False}
+_INT_RE = re.compile(r"^-?\d+$")
+_FLOAT_RE = re.compile(r"^-?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?$")
+
 def _try_cast(param):
-    if param == "None":
-        return None
-    if param == "True":
-        return True
-    if param == "False":
-        return False
+    # Classify with regexes instead of chained try/except; raising and
+    # catching a ValueError per non-matching type is slow in a loop.
+    if param in _LITERALS:
+        return _LITERALS[param]
 
-    try:
+    if _INT_RE.match(param):
         return int(param)
-    except ValueError:
+
+    if _FLOAT_RE.match(param):
+        return float(param)
+
+    # Only strings that can plausibly be JSON are worth parsing.
+    if param and param[0] in "{[\"'":
         try:
-            return float(param)
-        except ValueError:
+            return json.loads(param)
+        except json.JSONDecodeError:
             try:
-                return json.loads(param)
+                return json.loads(param.replace("'", '"'))
             except json.JSONDecodeError:
-                try:
-                    return json.loads(param.replace("'", '"'))
-                except json.JSONDecodeError:
-                    return str(param)
+                pass
+
+    return str(param)
 
 def format_value(val):
     if isinstance(val, float):
@@ -43,41 +62,34 @@ def format_raw_output(rows, columns=None):
     if rows == []:
         return 0
 
-    all_rows = []
-    row_lengths = []
-    for row_index, row in enumerate(rows):
-        if row_index == 0:
-            if columns:
-                row_lengths = [len(col[0]) for col in columns]
-            else:
-                row_lengths = [0] * len(row)
-
-        for col_index, col in enumerate(row):
-            data = format_value(col)
-            row_lengths[col_index] = max(len(data), row_lengths[col_index])
-
-        all_rows.append(row)
+    # Format every cell once up front; the print loop below reuses the
+    # strings instead of formatting each cell a second time.
+    formatted = [[format_value(col) for col in row] for row in rows]
 
     if columns:
-        row_fmt = []
-        for col_index, col in enumerate(columns):
-            padding = " " * (row_lengths[col_index] - len(col[0]))
-            row_fmt.append(f"{col[0]}{padding}")
+        row_lengths = [len(col[0]) for col in columns]
+    elif formatted:
+        row_lengths = [0] * len(formatted[0])
+    else:
+        return 0
 
-        print(" | ".join(row_fmt))
-        print("-" * (sum(row_lengths) + len(columns) * 3))
+    for row in formatted:
+        for col_index, data in enumerate(row):
+            if len(data) > row_lengths[col_index]:
+                row_lengths[col_index] = len(data)
 
-    for row in all_rows:
-        row_fmt = []
-        for col_index, col in enumerate(row):
-            data = format_value(col)
+    out_lines = []
+    if columns:
+        out_lines.append(" | ".join(col[0].ljust(row_lengths[col_index]) for col_index, col in enumerate(columns)))
+        out_lines.append("-" * (sum(row_lengths) + len(columns) * 3))
 
-            padding = " " * (row_lengths[col_index] - len(data))
-            row_fmt.append(f"{data}{padding}")
+    for row in formatted:
+        out_lines.append(" | ".join(data.ljust(row_lengths[col_index]) for col_index, data in enumerate(row)))
 
-        print(" | ".join(row_fmt))
+    # One write for the whole table instead of one syscall per row.
+    sys.stdout.write("\n".join(out_lines) + "\n")
 
-    return len(all_rows)
+    return len(formatted)
 
 def format_output(output, raw):
     rows_returned = 0
@@ -98,11 +110,13 @@ def format_output(output, raw):
     return rows_returned
 
 def run_query_function(database, query, *params, raw=False, print_query=False):
-    if not query.endswith(".sql") and not hasattr(database, query):
+    query_method = _resolve_query_method(type(database), query)
+    if not query.endswith(".sql") and query_method is None:
         print("The query is not supported by the given database. Exiting...")
         exit(0)
 
     time_start = time()
+    changes_before = database.connection.total_changes
 
     if query.endswith(".sql"):
         raw = False
@@ -110,10 +124,9 @@ def run_query_function(database, query, *params, raw=False, print_query=False):
             with open(query) as fp:
                 result = database.execute_query(fp.read())
     else:
-        query_func = getattr(database, query)
         params = list(map(_try_cast, params))
 
-        query_obj = query_func(*params)
+        query_obj = query_method(database, *params)
         if isinstance(query_obj, Query):
             if print_query:
                 print(query_obj)
@@ -134,43 +147,74 @@ def run_query_function(database, query, *params, raw=False, print_query=False):
     time_end = time()
     time_taken = f"{time_end - time_start:.3f} seconds."
 
-    rows_affected = database.connection.cursor().execute("SELECT changes()").fetchone()[0]
+    # Diffing total_changes avoids allocating a cursor and running a
+    # query just to read changes().
+    rows_affected = database.connection.total_changes - changes_before
     if rows_affected > 0:
         print(f"Rows affected: {rows_affected} in {time_taken}")
-    elif rows_affected is None:
-        print("Unknown rows affected.")
     else:
         print(f"Rows returned: {rows_returned} in {time_taken}")
 
-def run_query_string(query: str, conn: Connection | Session):
-    if isinstance(conn, Connection): # SQLite built-in
-        return conn.cursor().execute(query)
+# The helpers below pick an implementation per concrete type through a
+# dict lookup instead of walking the MRO with isinstance on every call.
+# Unseen subclasses are classified once with isinstance and cached.
+def _dispatch(table, sqlite_func, sqlalchemy_func, sqlite_cls, obj):
+    func = table.get(type(obj))
+    if func is None:
+        func = sqlite_func if isinstance(obj, sqlite_cls) else sqlalchemy_func
+        table[type(obj)] = func
 
-    return conn.execute(text(query)) # SQLAlchemy
+    return func
 
-def get_column_names(result: Cursor | Result):
-    if isinstance(result, Cursor): # SQLite built-in
-        return result.description
+def _query_sqlite(query, conn):
+    return conn.cursor().execute(query)
 
+def _query_sqlalchemy(query, conn):
+    return conn.execute(_compiled_text(query))
+
+_QUERY_FUNCS = {Connection: _query_sqlite, Session: _query_sqlalchemy}
+
+def run_query_string(query: str, conn: Connection | Session):
+    return _dispatch(_QUERY_FUNCS, _query_sqlite, _query_sqlalchemy, Connection, conn)(query, conn)
+
+def _columns_sqlite(result):
+    return result.description
+
+def _columns_sqlalchemy(result):
     try:
-        return [[str(key)] for key in result.keys()] # SQLAlchemy
+        return [[str(key)] for key in result.keys()]
     except ResourceClosedError:
         return []
 
-def extract_rows(result: Cursor | Result) -> List[Tuple[str]]:
-    if isinstance(result, Cursor): # SQLite built-in
-        return result
+_COLUMN_FUNCS = {Cursor: _columns_sqlite, Result: _columns_sqlalchemy}
+
+def get_column_names(result: Cursor | Result):
+    return _dispatch(_COLUMN_FUNCS, _columns_sqlite, _columns_sqlalchemy, Cursor, result)(result)
 
+def _rows_sqlite(result):
+    return result
+
+def _rows_sqlalchemy(result):
     try:
-        return [] if result.closed else result.fetchall() # SQLAlchemy
+        return [] if result.closed else result.fetchall()
     except ResourceClosedError:
         return []
 
+_ROW_FUNCS = {Cursor: _rows_sqlite, Result: _rows_sqlalchemy}
+
+def extract_rows(result: Cursor | Result) -> List[Tuple[str]]:
+    return _dispatch(_ROW_FUNCS, _rows_sqlite, _rows_sqlalchemy, Cursor, result)(result)
+
+def _affected_sqlite(conn):
+    return conn.cursor().execute("SELECT changes()").fetchone()[0]
+
+def _affected_sqlalchemy(conn):
+    return conn.execute(_compiled_text("SELECT changes()")).scalar_one_or_none()
+
+_AFFECTED_FUNCS = {Connection: _affected_sqlite, Session: _affected_sqlalchemy}
+
 def get_rows_affected(conn: Connection | Session):
-    if isinstance(conn, Connection): # SQLite built-in
-        return conn.cursor().execute("SELECT changes()").fetchone()[0]
-    
-    return conn.execute(text("SELECT changes()")).scalar_one_or_none()
+    return _dispatch(_AFFECTED_FUNCS, _affected_sqlite, _affected_sqlalchemy, Connection, conn)(conn)
 
 def query_or_repl(
     database: Database,
@@ -192,6 +236,10 @@ def query_or_repl(
         else:
             # Launch REPL-like loop
             conn = database.connection
+            is_sqlite = isinstance(conn, Connection)
+            # One reusable cursor for the whole session instead of
+            # allocating a fresh one per command.
+            cursor = conn.cursor() if is_sqlite else None
             while True:
                 try:
                     query = input(">")
@@ -204,13 +252,14 @@ def query_or_repl(
                         continue
 
                     time_start = time()
+                    changes_before = conn.total_changes if is_sqlite else None
 
                     try:
-                        result = run_query_string(query, conn)
+                        result = cursor.execute(query) if is_sqlite else run_query_string(query, conn)
                     except Exception as exc:
                         print("Error during query:", str(exc))
                         continue
-                    
+
                     column_names = get_column_names(result)
                     rows = extract_rows(result)
 
@@ -223,7 +272,12 @@ def query_or_repl(
                     if rows_returned != 0:
                         print(f"Rows returned: {rows_returned} in {time_taken}")
                     else:
-                        rows_affected = get_rows_affected(conn)
+                        # total_changes delta avoids a changes() query;
+                        # the SQLAlchemy path still asks the database.
+                        if is_sqlite:
+                            rows_affected = conn.total_changes - changes_before
+                        else:
+                            rows_affected = get_rows_affected(conn)
                         print(f"Rows affected: {rows_affected} in {time_taken}")
 
                 except (OperationalError, ProgrammingError) as exc:
@@ -20,8 +20,9 @@ def restartable(func):
                     without_name.remove("--restartable")
                     process = subprocess.Popen([sys.executable, file_to_restart, *without_name])
 
-                    while process.poll() is None: # Wait for child process to exit.
-                        sleep(0.1)
+                    # Block in the kernel until the child exits instead of
+                    # polling it ten times a second.
+                    process.wait()
 
                     if process.returncode == 2: # Process requested a restart.
                         sleep(1) # Sleep for a sec and restart while loop.
@@ -41,8 +42,7 @@ def restartable(func):
 
                 # Wait for child process to exit properly.
                 try:
-                    while process.poll() is None:
-                        sleep(0.1)
+                    process.wait()
                 except KeyboardInterrupt:
                     return
 
@@ -3,26 +3,42 @@ import json
 import flask
 from flask_socketio import SocketIO
 
+try:
+    # orjson serializes straight to bytes in C, skipping the
+    # intermediate str and its utf-8 encode on Response construction.
+    from orjson import dumps as _orjson_dumps, OPT_NON_STR_KEYS
+
+    def _dumps(data):
+        # OPT_NON_STR_KEYS coerces non-string dict keys like
+        # json.dumps does, instead of raising TypeError.
+        return _orjson_dumps(data, option=OPT_NON_STR_KEYS)
+except ImportError:
+    def _dumps(data):
+        return json.dumps(data).encode("utf-8")
+
 socket_io: SocketIO = None
 
+# Persistent template variables, bound here by init.create_app and
+# init.set_persistent_data so renders don't go through the app-context
+# proxy and config lookup on every request.
+_persistent_data = {}
+
 def set_cookie(key, value, max_age, response):
     path = flask.current_app.name
 
     response.set_cookie(key, value, max_age, path=f"/{path}")
 
 def make_template_context(template, status=200, **variables):
-    variables.update(flask.current_app.config["PERSISTENT_DATA"])
+    variables.update(_persistent_data)
     return flask.render_template(template, **variables), status
 
 def make_json_response(data, http_code):
     if not isinstance(data, dict):
         data = {"response": str(data)}
 
-    resp = flask.Response(response=json.dumps(data), status=http_code, mimetype="application/json")
-    resp.headers["Content-Type"] = "application/json; charset=utf-8"
-    return resp
+    # Passing the full content type sets the header once, instead of
+    # mimetype= setting it and the charset'd value overwriting it.
+    return flask.Response(response=_dumps(data), status=http_code, content_type="application/json; charset=utf-8")
 
 def make_text_response(text, status_code):
-    resp = flask.Response(response=text, status=status_code, mimetype="text/raw")
-    resp.headers["Content-Type"] = "text/raw; charset=utf-8"
-    return resp
+    return flask.Response(response=text, status=status_code, content_type="text/raw; charset=utf-8")
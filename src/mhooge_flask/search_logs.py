@@ -1,53 +1,79 @@
 import argparse
-from datetime import datetime, timedelta
-from glob import glob
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
 import json
+import mmap
+import os
 import re
-from multiprocessing.pool import ThreadPool
-from time import sleep
 
 from . import logging
+from .utils import CPH_TZ
+
+try:
+    # orjson parses with SIMD acceleration; on million-line scans the
+    # JSON parse is the dominant cost, so this is the biggest single win.
+    from orjson import loads as _json_loads, dumps as _orjson_dumps, OPT_INDENT_2
+
+    def _json_dumps_pretty(data):
+        return _orjson_dumps(data, option=OPT_INDENT_2).decode("utf-8")
+except ImportError:
+    from json import loads as _json_loads
+
+    def _json_dumps_pretty(data):
+        return json.dumps(data, indent=4)
+
+# Parsed timestamp tokens repeat heavily across bursts of log lines, so
+# cache them; a dict hit is far cheaper than re-parsing the ISO string.
+_ts_cache: dict = {}
 
 def get_log_timestamp(log_data):
     if isinstance(log_data, str):
+        token = log_data.split(" ", 1)[0]
+        try:
+            return _ts_cache[token]
+        except KeyError:
+            pass
+
         try:
-            dt = datetime.fromisoformat(log_data.split(" ")[0])
-            return dt.timestamp()
+            timestamp = datetime.fromisoformat(token).timestamp()
         except ValueError:
-            return None
+            timestamp = None
+
+        if len(_ts_cache) > 65536:
+            _ts_cache.clear()
+        _ts_cache[token] = timestamp
+
+        return timestamp
 
     return log_data["record"].get("time", {}).get("timestamp", None)
 
 def search_regex(text, pattern):
-    match = re.search(pattern, text)
-
-    if text.strip() == "":
-        return None
+    match = pattern.search(text)
 
     return None if match is None else match.group(0)
 
-def search_for_key(record, key, value):
-    nested_keys = key.split(".")
+# Sentinel distinguishing "key missing" from an actual None value, so
+# the traversal needs one dict lookup per level instead of a membership
+# test followed by a get.
+_MISS = object()
 
+def search_for_key(record, nested_keys, value):
     unpacked_value = record
 
-    key_in_container = True
-
     for nested_key in nested_keys:
-        if unpacked_value is None or nested_key not in unpacked_value:
-            key_in_container = False
+        if not isinstance(unpacked_value, dict):
+            return None
 
-        unpacked_value = unpacked_value.get(nested_key)
+        unpacked_value = unpacked_value.get(nested_key, _MISS)
+        if unpacked_value is _MISS:
+            return None
 
     if isinstance(unpacked_value, dict):
         raise ValueError(
-            f"The key to search for: {key} is invalid. "
+            f"The key to search for: {'.'.join(nested_keys)} is invalid. "
             "Maybe you need sub key (main.sub)?."
         )
 
-    if not key_in_container:
-        return None
-    
     if value is None:
         return str(unpacked_value)
 
@@ -72,21 +98,33 @@ def search_json(record, include_keys, exclude_keys):
 
     return None
 
-def search_line(line, args):
-    if line.strip() == "":
+def search_line(line, time_from, time_to, include_keys, exclude_keys, regex):
+    # isspace avoids the copy that strip() allocates just to test
+    # emptiness on every line.
+    if not line or line.isspace():
         return None
 
-    log_record = None
+    has_date_filter = time_from is not None or time_to is not None
+    log_date = None
+
+    if has_date_filter:
+        # Peek the leading ISO token and reject lines outside the
+        # window before paying for a JSON parse. On time-sliced
+        # searches most lines never get parsed at all.
+        log_date = get_log_timestamp(line)
+        if log_date is not None and (
+            (time_from is not None and log_date < time_from)
+            or (time_to is not None and log_date > time_to)
+        ):
+            return None
 
     try:
-        log_record = json.loads(line)
-    except (json.JSONDecodeError, TypeError):
+        log_record = _json_loads(line)
+    except (ValueError, TypeError):
         return None
 
-    if args.date_from is not None or args.date_to is not None:
-        time_from = args.date_from
-        time_to = args.date_to
-        log_date = get_log_timestamp(log_record if log_record is not None else line)
+    if has_date_filter and log_date is None:
+        log_date = get_log_timestamp(log_record)
 
         # Check if log record falls within specified timeframe.
         if (
@@ -96,43 +134,155 @@ def search_line(line, args):
         ):
             return None
 
-    if args.include or args.exclude:
-        return search_json(log_record["record"], args.include, args.exclude)
-    elif args.regex is not None:
-        return search_regex(line, args.regex)
+    if include_keys or exclude_keys:
+        return search_json(log_record["record"], include_keys, exclude_keys)
+    elif regex is not None:
+        return search_regex(line, regex)
 
     return line
 
 def datetime_type(iso_string, max_date):
     try:
         dt = datetime.fromisoformat(iso_string)
-        if len(iso_string) <= 10:
-            if max_date:
-                dt = dt.replace(hour=23, minute=59, second=59)
-
-        return (dt - timedelta(hours=1)).timestamp()
     except ValueError:
         raise argparse.ArgumentTypeError("Invalid ISO datetime string")
 
+    if max_date and len(iso_string) <= 10:
+        dt = dt.replace(hour=23, minute=59, second=59)
+
+    # Interpret the bound as Copenhagen time via the shared tzinfo
+    # instead of the old fixed -1h shift, which was an hour off on one
+    # side of every DST switch.
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=CPH_TZ)
+
+    return dt.timestamp()
+
 def key_value_type(kv_string):
-    split = kv_string.split("=")
+    if kv_string.count("=") > 1:
+        raise argparse.ArgumentTypeError("Invalid key-value string")
+
+    key, _, value = kv_string.partition("=")
+
+    # Split the dotted key and compile the value pattern here, at
+    # argparse time, so the per-record search never redoes either.
+    return tuple(key.split(".")), re.compile(value) if value else None
+
+def _scan_regex_only(mapped, pattern):
+    """
+    Run the compiled pattern across the whole mapping in one pass, so
+    the regex engine walks the bytes in C without per-line Python
+    overhead, then recover the enclosing line of each match.
+    """
+    # Byte-pattern equivalent of the user's str pattern; the UNICODE
+    # flag is implicit on str patterns and invalid on bytes ones.
+    byte_pattern = re.compile(
+        pattern.pattern.encode("utf-8"),
+        (pattern.flags & ~re.UNICODE) | re.MULTILINE
+    )
 
-    if len(split) == 1:
-        return kv_string, None
-    if len(split) == 2:
-        return tuple(split)
+    found_lines = []
+    size = mapped.size()
+    prev_start = -1
+    for match in byte_pattern.finditer(mapped):
+        line_start = mapped.rfind(b"\n", 0, match.start()) + 1
+        if line_start == prev_start: # Only the first match per line.
+            continue
+
+        prev_start = line_start
+        line_end = mapped.find(b"\n", match.end())
+        if line_end == -1:
+            line_end = size
+
+        line = mapped[line_start:line_end].decode("utf-8", errors="replace")
+
+        # The per-line path only matches JSON records (search_line drops
+        # lines that fail to parse); keep the same contract here. Only
+        # matched lines pay for the parse.
+        try:
+            _json_loads(line)
+        except ValueError:
+            continue
+
+        found_lines.append((line, match.group(0).decode("utf-8", errors="replace")))
 
-    raise argparse.ArgumentTypeError("Invalid key-value string")
+    return found_lines
 
 def process_file(log_file, args):
     found_lines = []
-    with open(log_file, "r", encoding="utf-8") as fp:
-        for line in fp:
-            if (found_part := search_line(line, args)) is not None:
-                found_lines.append((line, found_part))
+    # Unpack the namespace once; the per-line path then works on locals
+    # instead of doing attribute lookups on args for every line.
+    time_from = args.date_from
+    time_to = args.date_to
+    include_keys = args.include
+    exclude_keys = args.exclude
+    regex = args.regex
+    has_date_filter = time_from is not None or time_to is not None
+
+    # Scan the file through mmap and slice on newlines, so lines that a
+    # date filter rejects are never decoded or allocated as str at all.
+    with open(log_file, "rb") as fp:
+        try:
+            mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: # Empty file.
+            return found_lines
+
+        try:
+            if args.regex is not None and not args.include and not args.exclude and not has_date_filter:
+                return _scan_regex_only(mapped, args.regex)
+
+            size = mapped.size()
+            start = 0
+            while start < size:
+                end = mapped.find(b"\n", start)
+                if end == -1:
+                    end = size
+
+                chunk = mapped[start:end]
+                start = end + 1
+
+                if has_date_filter:
+                    token = chunk.split(b" ", 1)[0]
+                    try:
+                        log_date = get_log_timestamp(token.decode("utf-8"))
+                    except UnicodeDecodeError:
+                        log_date = None
+
+                    if log_date is not None and (
+                        (time_from is not None and log_date < time_from)
+                        or (time_to is not None and log_date > time_to)
+                    ):
+                        continue
+
+                line = chunk.decode("utf-8", errors="replace")
+                found_part = search_line(line, time_from, time_to, include_keys, exclude_keys, regex)
+                if found_part is not None:
+                    found_lines.append((line, found_part))
+        finally:
+            mapped.close()
 
     return found_lines
 
+def _emit(line, found_part, pretty=False):
+    # The codec drops non-encodable characters in C; the old
+    # per-character try/except loop raised a Python exception for
+    # every stripped codepoint.
+    new_line = line.encode("cp1252", errors="ignore").decode("cp1252")
+
+    if pretty:
+        try:
+            to_json = _json_loads(new_line)
+            new_line = _json_dumps_pretty(to_json)
+        except ValueError:
+            pass
+
+    # Escape the matched part the same way as the line, otherwise a
+    # match containing '<' never lines up with the escaped text.
+    escaped_part = found_part.replace("<", "\\<")
+    new_line = new_line.replace("<", "\\<").replace(escaped_part, f"<yellow>{escaped_part}</yellow>", 1)
+
+    logging.logger.bind(_kind=logging._KIND_IGNORE).opt(colors=True).info(new_line)
+
 def main():
     log_path = logging.LOG_FOLDER
 
@@ -144,45 +294,37 @@ def main():
     parser.add_argument("--regex", type=str)
     parser.add_argument("--date-from", type=lambda x: datetime_type(x, False), help="ISO format datetime string")
     parser.add_argument("--date-to", type=lambda x: datetime_type(x, True), help="ISO format datetime string")
+    parser.add_argument("--pretty", action="store_true", help="Pretty-print matched JSON lines")
 
     args = parser.parse_args()
 
-    log_files = glob(f"{log_path}/{args.log_file}*.log")
-
-    futures = []
-    with ThreadPool(32) as pool:
-        for log_file in log_files:
-            future = pool.apply_async(process_file, (log_file,args))
-            futures.append(future)
-
-        while any(not future.ready() for future in futures):
-            sleep(0.1)
-
-    pool.join()
-
-    found_lines = []
-    for future in futures:
-        found_lines.extend(future.get())
-
-    for line, found_part in found_lines:
-        new_line = ""
-        for c in line:
-            try:
-                c.encode("cp1252")
-                new_line += c
-            except UnicodeEncodeError:
-                pass
-
-        try:
-            to_json = json.loads(new_line)
-            new_line = json.dumps(to_json, indent=4)
-        except json.JSONDecodeError:
-            pass
-
-        new_line = new_line.replace("<", "\\<")
-        new_line = new_line.replace(found_part, f"<yellow>{found_part}</yellow>")
-
-        logging.logger.bind(ignore=True).opt(colors=True).info(new_line)
+    # Compile the pattern once; the scan loops then call
+    # pattern.search directly instead of going through re.search's
+    # per-call pattern-cache lookup on every line.
+    if args.regex is not None:
+        args.regex = re.compile(args.regex)
+
+    prefix = args.log_file
+
+    def iter_log_files():
+        # scandir streams directory entries without glob's stat-heavy
+        # pattern matching, so workers start on the first file while
+        # the rest of the directory is still being listed.
+        with os.scandir(log_path) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.startswith(prefix) and entry.name.endswith(".log"):
+                    yield entry.path
+
+    # The scan is CPU-bound (JSON parsing and regex matching), so
+    # threads just serialize on the GIL; processes scale with cores.
+    with ProcessPoolExecutor() as pool:
+        futures = [pool.submit(process_file, log_file, args) for log_file in iter_log_files()]
+
+        # Emit matches as each file finishes, overlapping the output
+        # formatting with the scans still running in the pool.
+        for future in as_completed(futures):
+            for line, found_part in future.result():
+                _emit(line, found_part, args.pretty)
 
 if __name__ == "__main__":
     main()
@@ -1,8 +1,32 @@
 from datetime import datetime, timedelta, tzinfo
 
-def _last_sunday_in_month(dt: datetime) -> bool:
-    days_offset = list(range(6, -1, -1))
-    return 31 - dt.day <= days_offset[dt.weekday()]
+# Offset singletons; dst/utcoffset run in timestamp-formatting loops
+# and shouldn't allocate a fresh timedelta per call.
+_DST_ON = timedelta(hours=2)
+_DST_OFF = timedelta(0)
+_STD_OFFSET = timedelta(hours=1)
+
+# DST transition datetimes per year, computed once and reused. The
+# offset checks then reduce to two ordered comparisons per call instead
+# of re-deriving last-Sunday arithmetic for every timestamp.
+_dst_cache: dict[int, tuple[datetime, datetime]] = {}
+
+def _transitions(year: int) -> tuple[datetime, datetime]:
+    if (cached := _dst_cache.get(year)) is not None:
+        return cached
+
+    # DST runs from the last Sunday of March 02:00 to the last Sunday
+    # of October 03:00. Both months have 31 days, so step back from the
+    # 31st to the preceding Sunday.
+    start = datetime(year, 3, 31, 2)
+    start -= timedelta(days=(start.weekday() + 1) % 7)
+
+    end = datetime(year, 10, 31, 3)
+    end -= timedelta(days=(end.weekday() + 1) % 7)
+
+    _dst_cache[year] = (start, end)
+
+    return start, end
 
 class CPHTimeZone(tzinfo):
     def tzname(self, dt: datetime | None) -> str | None:
@@ -10,19 +34,15 @@ class CPHTimeZone(tzinfo):
 
     def utcoffset(self, dt: datetime | None) -> timedelta | None:
         dst = self.dst(dt)
-        return dst if dst.total_seconds() > 0 else timedelta(hours=1)
-    
-    def dst(self, dt: datetime | None) -> timedelta:
-        if dt.month > 3 and dt.month < 10:
-            return timedelta(hours=2)
+        return dst if dst is _DST_ON else _STD_OFFSET
 
-        if dt.month < 3 or dt.month > 10:
-            return timedelta(hours=0)
-
-        if dt.month == 3 and dt.day > 24 and _last_sunday_in_month(dt):
-            return timedelta(hours=2)
+    def dst(self, dt: datetime | None) -> timedelta:
+        start, end = _transitions(dt.year)
+        if dt.tzinfo is not None:
+            dt = dt.replace(tzinfo=None)
 
-        if dt.month == 10 and (dt.day < 25 or not _last_sunday_in_month(dt)):
-            return timedelta(hours=2)
+        return _DST_ON if start <= dt < end else _DST_OFF
 
-        return timedelta(hours=0)
+# Shared instance; the timezone is stateless, so callers should use
+# this instead of constructing a CPHTimeZone per datetime.
+CPH_TZ = CPHTimeZone()